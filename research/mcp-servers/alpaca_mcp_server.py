@@ -3,6 +3,7 @@
 Alpaca MCP Server - Real integration with Alpaca Trading API
 """
 
+import argparse
 import asyncio
 import json
 import sys
@@ -15,12 +16,17 @@ from alpaca.trading.client import TradingClient
 from alpaca.trading.requests import (
     MarketOrderRequest, 
     LimitOrderRequest,
-    GetOrdersRequest
+    GetOrdersRequest,
+    GetAssetsRequest
 )
-from alpaca.trading.enums import OrderSide, TimeInForce, OrderType, QueryOrderStatus
+from alpaca.trading.enums import OrderSide, TimeInForce, OrderType, QueryOrderStatus, AssetStatus, AssetClass
 from alpaca.data.live import StockDataStream
 from alpaca.data.requests import StockLatestQuoteRequest
 from alpaca.data import StockHistoricalDataClient
+from session_trace import TracePlayer, recorder_from_env, request_uuid
+from tool_calls import ToolCallServer, write_started, write_rejected
+from rate_limiter import RequestScheduler, PRIORITY_WRITE, PRIORITY_READ, PRIORITY_POLL
+from pretrade import PreTradeValidator
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,15 +36,18 @@ logger = logging.getLogger(__name__)
 from dotenv import load_dotenv
 load_dotenv(Path(__file__).parent.parent / ".env")
 
-class AlpacaMCPServer:
-    def __init__(self):
+class AlpacaMCPServer(ToolCallServer):
+    def __init__(self, replay: bool = False):
         self.api_key = os.getenv('ALPACA_API_KEY')
         self.secret_key = os.getenv('ALPACA_SECRET_KEY')
         self.paper_trade = os.getenv('ALPACA_PAPER_TRADE', 'True').lower() == 'true'
         
         if not self.api_key or not self.secret_key:
-            logger.error("Missing Alpaca API credentials")
-            sys.exit(1)
+            if not replay:
+                logger.error("Missing Alpaca API credentials")
+                sys.exit(1)
+            # Upstream calls are answered from the trace, so credentials are never used
+            self.api_key = self.secret_key = 'replay'
         
         # Initialize Alpaca clients
         self.trading_client = TradingClient(
@@ -50,6 +59,42 @@ class AlpacaMCPServer:
             self.api_key,
             self.secret_key
         )
+        # The scheduler below is the only 429 retry path; leave the SDK's own
+        # retry loop to transient gateway errors so backoffs don't nest
+        for client in (self.trading_client, self.data_client):
+            client._retry_codes = [code for code in getattr(client, '_retry_codes', [504]) if code != 429]
+        
+        # Client-side quotas per upstream endpoint class: (requests/minute, burst).
+        # Replay answers from the trace, so it skips throttling to keep timings honest.
+        self.scheduler = RequestScheduler({
+            'trading': (
+                float(os.getenv('ALPACA_TRADING_RPM', '200')),
+                int(os.getenv('ALPACA_TRADING_BURST', '10'))
+            ),
+            'market_data': (
+                float(os.getenv('ALPACA_DATA_RPM', '200')),
+                int(os.getenv('ALPACA_DATA_BURST', '10'))
+            )
+        }, throttle=not replay)
+        # How long reads may queue for a token before giving up (writes never expire)
+        self.read_queue_timeout = float(os.getenv('ALPACA_READ_QUEUE_TIMEOUT', '10'))
+        
+        # Local asset index (refreshed daily) and buying power cache for pre-trade checks
+        self.pretrade = PreTradeValidator(
+            asset_ttl=float(os.getenv('ALPACA_ASSET_INDEX_TTL', '86400')),
+            account_ttl=float(os.getenv('ALPACA_BUYING_POWER_TTL', '30')),
+            price_ttl=float(os.getenv('ALPACA_PRICE_CACHE_TTL', '60'))
+        )
+        self.pretrade_lock = asyncio.Lock()
+        
+        # Tool deadlines, worker pool and load shedding (ALPACA_TOOL_TIMEOUT, ALPACA_MAX_CONCURRENT, ...)
+        self._init_tool_calls('ALPACA', {
+            'place_stock_order': 30.0,
+            'cancel_order': 30.0
+        })
+        
+        # Opt-in session trace (ALPACA_TRACE_FILE); replay installs a TracePlayer instead
+        self.trace = None if replay else recorder_from_env('ALPACA')
         
         logger.info(f"Alpaca MCP Server initialized (paper_trade={self.paper_trade})")
 
@@ -110,7 +155,8 @@ class AlpacaMCPServer:
                                         'side': {'type': 'string', 'enum': ['buy', 'sell']},
                                         'quantity': {'type': 'number', 'description': 'Number of shares'},
                                         'order_type': {'type': 'string', 'enum': ['market', 'limit']},
-                                        'limit_price': {'type': 'number', 'description': 'Limit price (for limit orders)'}
+                                        'limit_price': {'type': 'number', 'description': 'Limit price (for limit orders)'},
+                                        'client_order_id': {'type': 'string', 'description': 'Idempotency key; reuse it when retrying the same order'}
                                     },
                                     'required': ['symbol', 'side', 'quantity', 'order_type']
                                 }
@@ -157,29 +203,22 @@ class AlpacaMCPServer:
                                     'properties': {},
                                     'required': []
                                 }
+                            },
+                            {
+                                'name': 'get_rate_limit_stats',
+                                'description': 'Get client-side rate limiter queue and throttling statistics',
+                                'inputSchema': {
+                                    'type': 'object',
+                                    'properties': {},
+                                    'required': []
+                                }
                             }
                         ]
                     }
                 }
             
             elif method == 'tools/call':
-                tool_name = params.get('name')
-                arguments = params.get('arguments', {})
-                
-                result = await self.execute_tool(tool_name, arguments)
-                
-                return {
-                    'jsonrpc': '2.0',
-                    'id': request_id,
-                    'result': {
-                        'content': [
-                            {
-                                'type': 'text',
-                                'text': json.dumps(result, indent=2)
-                            }
-                        ]
-                    }
-                }
+                return await self.call_tool(request_id, params)
             
             else:
                 return {
@@ -207,7 +246,8 @@ class AlpacaMCPServer:
         
         try:
             if tool_name == 'get_account_info':
-                account = self.trading_client.get_account()
+                account = await self._read('trading', self.trading_client.get_account)
+                self.pretrade.load_account(account)
                 return {
                     'account_id': str(account.id),
                     'cash': float(account.cash),
@@ -222,7 +262,9 @@ class AlpacaMCPServer:
                 }
             
             elif tool_name == 'get_positions':
-                positions = self.trading_client.get_all_positions()
+                positions = await self._read('trading', self.trading_client.get_all_positions)
+                for pos in positions:
+                    self.pretrade.record_price(str(pos.symbol), pos.current_price)
                 return [
                     {
                         'symbol': str(pos.symbol),
@@ -244,6 +286,16 @@ class AlpacaMCPServer:
                 quantity = arguments.get('quantity')
                 order_type = arguments.get('order_type', 'market')
                 limit_price = arguments.get('limit_price')
+                # Alpaca refuses a second order with the same client_order_id, so a
+                # client retrying after a timeout can't place the order twice
+                client_order_id = arguments.get('client_order_id') or request_uuid()
+                arguments = {**arguments, 'client_order_id': client_order_id}
+                
+                # Reject orders that cannot succeed before spending a broker round-trip.
+                # Market buys are costed from prices already cached by quotes and
+                # positions; the order path never waits on an extra quote.
+                await self._refresh_pretrade_cache()
+                symbol = self.pretrade.validate(symbol, side, quantity, order_type, limit_price)
                 
                 # Create order request based on type
                 if order_type == 'market':
@@ -251,7 +303,8 @@ class AlpacaMCPServer:
                         symbol=symbol,
                         qty=quantity,
                         side=OrderSide.BUY if side == 'buy' else OrderSide.SELL,
-                        time_in_force=TimeInForce.DAY
+                        time_in_force=TimeInForce.DAY,
+                        client_order_id=client_order_id
                     )
                 else:
                     if not limit_price:
@@ -261,11 +314,14 @@ class AlpacaMCPServer:
                         qty=quantity,
                         side=OrderSide.BUY if side == 'buy' else OrderSide.SELL,
                         time_in_force=TimeInForce.DAY,
-                        limit_price=limit_price
+                        limit_price=limit_price,
+                        client_order_id=client_order_id
                     )
                 
                 # Submit order
-                order = self.trading_client.submit_order(order_request)
+                order = await self._write('trading', self.trading_client.submit_order, order_request)
+                if side == 'buy':
+                    self.pretrade.reserve(self.pretrade.order_cost(symbol, quantity, limit_price) or 0)
                 
                 return {
                     'id': str(order.id),
@@ -285,8 +341,12 @@ class AlpacaMCPServer:
             elif tool_name == 'get_stock_quote':
                 symbol = arguments.get('symbol')
                 request = StockLatestQuoteRequest(symbol_or_symbols=symbol)
-                quotes = self.data_client.get_stock_latest_quote(request)
+                quotes = await self._read(
+                    'market_data', self.data_client.get_stock_latest_quote, request,
+                    priority=PRIORITY_POLL
+                )
                 quote = quotes[symbol]
+                self.pretrade.record_price(symbol, quote.ask_price or quote.bid_price)
                 
                 return {
                     'symbol': symbol,
@@ -308,7 +368,7 @@ class AlpacaMCPServer:
                     limit=limit
                 )
                 
-                orders = self.trading_client.get_orders(request_params)
+                orders = await self._read('trading', self.trading_client.get_orders, request_params)
                 
                 return [
                     {
@@ -328,14 +388,14 @@ class AlpacaMCPServer:
             
             elif tool_name == 'cancel_order':
                 order_id = arguments.get('order_id')
-                self.trading_client.cancel_order_by_id(order_id)
+                await self._write('trading', self.trading_client.cancel_order_by_id, order_id)
                 return {
                     'success': True,
                     'message': f'Order {order_id} cancelled successfully'
                 }
             
             elif tool_name == 'get_market_clock':
-                clock = self.trading_client.get_clock()
+                clock = await self._read('trading', self.trading_client.get_clock)
                 return {
                     'is_open': clock.is_open,
                     'next_open': str(clock.next_open),
@@ -343,6 +403,9 @@ class AlpacaMCPServer:
                     'timestamp': str(clock.timestamp)
                 }
             
+            elif tool_name == 'get_rate_limit_stats':
+                return self.scheduler.stats()
+            
             else:
                 raise ValueError(f"Unknown tool: {tool_name}")
                 
@@ -354,31 +417,64 @@ class AlpacaMCPServer:
                 'arguments': arguments
             }
 
+    async def _read(self, endpoint: str, fn, *args, priority: int = PRIORITY_READ) -> Any:
+        """Rate-limited upstream read; gives up if it queues past the read timeout"""
+        return await self.scheduler.call(
+            endpoint, self._traced(endpoint, fn), *args, priority=priority, timeout=self.read_queue_timeout
+        )
+
+    async def _write(self, endpoint: str, fn, *args) -> Any:
+        """Rate-limited upstream write; jumps the queue and is retried until accepted.
+
+        Deadlines and cancellation stop it only while it is queued or waiting
+        to be retried after a 429, never while an attempt is on the wire.
+        """
+        return await self.scheduler.call(
+            endpoint, self._traced(endpoint, fn), *args, priority=PRIORITY_WRITE, max_retries=None,
+            on_start=write_started, on_rejected=write_rejected
+        )
+
+    async def _refresh_pretrade_cache(self):
+        """Reload the asset index and buying power when their TTLs have lapsed"""
+        async with self.pretrade_lock:
+            if self.pretrade.assets_stale():
+                try:
+                    assets = await self._read(
+                        'trading', self.trading_client.get_all_assets,
+                        GetAssetsRequest(status=AssetStatus.ACTIVE, asset_class=AssetClass.US_EQUITY)
+                    )
+                    self.pretrade.load_assets(assets)
+                    logger.info(f"Loaded asset index ({len(self.pretrade.assets)} symbols)")
+                except Exception as e:
+                    logger.warning(f"Could not load asset index, symbol checks skipped: {e}")
+                    self.pretrade.defer_assets(300)
+            
+            if self.pretrade.account_stale():
+                try:
+                    account = await self._read('trading', self.trading_client.get_account)
+                    self.pretrade.load_account(account)
+                except Exception as e:
+                    logger.warning(f"Could not refresh buying power: {e}")
+                    self.pretrade.defer_account(self.pretrade.account_ttl)
+
+    def _traced(self, endpoint: str, fn):
+        """Route an upstream call through the session recorder or replay player, if any"""
+        return self.trace.wrap(endpoint, fn) if self.trace else fn
+
     async def run(self):
         """Main server loop"""
         logger.info("Starting Alpaca MCP Server...")
-        
-        while True:
-            try:
-                line = await asyncio.get_event_loop().run_in_executor(None, sys.stdin.readline)
-                if not line:
-                    break
-                
-                line = line.strip()
-                if not line:
-                    continue
-                
-                request = json.loads(line)
-                response = await self.handle_request(request)
-                
-                print(json.dumps(response), flush=True)
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Invalid JSON: {e}")
-            except Exception as e:
-                logger.error(f"Server error: {e}")
-                break
+        await self.serve()
 
 if __name__ == '__main__':
-    server = AlpacaMCPServer()
-    asyncio.run(server.run())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Alpaca MCP Server')
+    parser.add_argument('--replay', metavar='TRACE', help='Replay a recorded session trace offline and print a summary')
+    args = parser.parse_args()
+    
+    if args.replay:
+        server = AlpacaMCPServer(replay=True)
+        summary = asyncio.run(TracePlayer(args.replay).replay(server))
+        print(json.dumps(summary, indent=2))
+    else:
+        server = AlpacaMCPServer()
+        asyncio.run(server.run())
\ No newline at end of file
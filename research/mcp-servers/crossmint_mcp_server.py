@@ -3,16 +3,26 @@
 Crossmint MCP Server - Integration with Crossmint API for blockchain operations
 """
 
+import argparse
 import asyncio
 import json
 import sys
 import os
 import requests
+import functools
 from typing import Any, Dict, List, Optional
 import logging
 from pathlib import Path
-from datetime import datetime
-import random
+from session_trace import TracePlayer, recorder_from_env, request_clock, request_rng, request_uuid
+from tool_calls import ToolCallServer, write_started, write_rejected
+from rate_limiter import RequestScheduler, PRIORITY_WRITE, PRIORITY_READ
+from drought_sweep import (
+    DroughtSeries,
+    sweep_eligibility,
+    DEFAULT_LAGS,
+    DEFAULT_THRESHOLD,
+    DEFAULT_SUBSIDY_PER_POINT
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -22,14 +32,17 @@ logger = logging.getLogger(__name__)
 from dotenv import load_dotenv
 load_dotenv(Path(__file__).parent.parent / ".env")
 
-class CrossmintMCPServer:
-    def __init__(self):
+class CrossmintMCPServer(ToolCallServer):
+    def __init__(self, replay: bool = False):
         self.api_key = os.getenv('CROSSMINT_API_KEY')
         self.base_url = "https://staging.crossmint.com/api/2025-06-09"
         
         if not self.api_key:
-            logger.error("Missing Crossmint API credentials")
-            sys.exit(1)
+            if not replay:
+                logger.error("Missing Crossmint API credentials")
+                sys.exit(1)
+            # Upstream calls are answered from the trace, so credentials are never used
+            self.api_key = 'replay'
         
         self.headers = {
             "x-api-key": self.api_key,
@@ -40,6 +53,42 @@ class CrossmintMCPServer:
         self.farmer_ted_wallet = "0x639A356DB809fA45A367Bc71A6D766dF2e9C6D15"
         self.uncle_sam_wallet_id = "userId:unclesam:evm"
         
+        # Client-side quota for the Crossmint API: (requests/minute, burst).
+        # Balance reads and transfers share it; transfers are served first.
+        # Replay answers from the trace, so it skips throttling to keep timings honest.
+        self.scheduler = RequestScheduler({
+            'crossmint': (
+                float(os.getenv('CROSSMINT_RPM', '60')),
+                int(os.getenv('CROSSMINT_BURST', '5'))
+            )
+        }, throttle=not replay)
+        # How long reads may queue for a token before giving up (transfers never expire)
+        self.read_queue_timeout = float(os.getenv('CROSSMINT_READ_QUEUE_TIMEOUT', '10'))
+        # Socket timeout so a stalled Crossmint call can't hold a worker thread forever
+        self.http_timeout = float(os.getenv('CROSSMINT_HTTP_TIMEOUT', '30'))
+        # Timed-out transfers are resent this many times under the same idempotency key
+        self.transfer_timeout_retries = int(os.getenv('CROSSMINT_TRANSFER_TIMEOUT_RETRIES', '2'))
+        
+        # Tool deadlines, worker pool and load shedding (CROSSMINT_TOOL_TIMEOUT, CROSSMINT_MAX_CONCURRENT, ...)
+        self._init_tool_calls('CROSSMINT', {
+            'execute_subsidy_transfer': 60.0,
+            'verify_subsidy_eligibility': 60.0
+        })
+        
+        # Weekly basin drought index for eligibility sweeps; simulated unless a CSV is provided
+        drought_series_path = os.getenv('CROSSMINT_DROUGHT_SERIES')
+        try:
+            self.drought_series = (
+                DroughtSeries.from_csv(drought_series_path) if drought_series_path
+                else DroughtSeries.simulated()
+            )
+        except (OSError, ValueError) as e:
+            logger.error(f"Invalid drought series: {e}")
+            sys.exit(1)
+        
+        # Opt-in session trace (CROSSMINT_TRACE_FILE); replay installs a TracePlayer instead
+        self.trace = None if replay else recorder_from_env('CROSSMINT')
+        
         logger.info("Crossmint MCP Server initialized")
 
     async def handle_request(self, request: Dict[str, Any]) -> Dict[str, Any]:
@@ -112,6 +161,10 @@ class CrossmintMCPServer:
                                         'recipient': {
                                             'type': 'string',
                                             'description': 'Recipient wallet address (default: Farmer Ted)'
+                                        },
+                                        'idempotency_key': {
+                                            'type': 'string',
+                                            'description': 'Reuse when retrying the same transfer so it is only paid once'
                                         }
                                     },
                                     'required': ['amount']
@@ -148,29 +201,64 @@ class CrossmintMCPServer:
                                     },
                                     'required': []
                                 }
+                            },
+                            {
+                                'name': 'sweep_subsidy_eligibility',
+                                'description': 'Score many farmers against their basin drought index in one pass and return a ready-to-disburse subsidy batch',
+                                'inputSchema': {
+                                    'type': 'object',
+                                    'properties': {
+                                        'farmers': {
+                                            'type': 'array',
+                                            'description': 'Farmers to evaluate',
+                                            'items': {
+                                                'type': 'object',
+                                                'properties': {
+                                                    'farmer_id': {'type': 'string'},
+                                                    'basin': {
+                                                        'type': 'string',
+                                                        'description': 'Water basin (e.g. Chino_Basin)'
+                                                    },
+                                                    'recipient': {
+                                                        'type': 'string',
+                                                        'description': 'Recipient wallet address'
+                                                    }
+                                                },
+                                                'required': ['farmer_id', 'basin']
+                                            }
+                                        },
+                                        'threshold': {
+                                            'type': 'number',
+                                            'description': f'Drought index above which a farmer is eligible (default: {DEFAULT_THRESHOLD:g})'
+                                        },
+                                        'subsidy_per_point': {
+                                            'type': 'number',
+                                            'description': f'USDC per drought index point (default: {DEFAULT_SUBSIDY_PER_POINT:g})'
+                                        },
+                                        'lags': {
+                                            'type': 'array',
+                                            'items': {'type': 'integer'},
+                                            'description': 'Trailing windows in weeks; the score is the worse of the current week and each window mean (default: 8 and 12)'
+                                        }
+                                    },
+                                    'required': ['farmers']
+                                }
+                            },
+                            {
+                                'name': 'get_rate_limit_stats',
+                                'description': 'Get client-side rate limiter queue and throttling statistics',
+                                'inputSchema': {
+                                    'type': 'object',
+                                    'properties': {},
+                                    'required': []
+                                }
                             }
                         ]
                     }
                 }
             
             elif method == 'tools/call':
-                tool_name = params.get('name')
-                arguments = params.get('arguments', {})
-                
-                result = await self.execute_tool(tool_name, arguments)
-                
-                return {
-                    'jsonrpc': '2.0',
-                    'id': request_id,
-                    'result': {
-                        'content': [
-                            {
-                                'type': 'text',
-                                'text': json.dumps(result, indent=2)
-                            }
-                        ]
-                    }
-                }
+                return await self.call_tool(request_id, params)
             
             else:
                 return {
@@ -202,7 +290,10 @@ class CrossmintMCPServer:
                 
                 # Get Uncle Sam's balance
                 url = f"{self.base_url}/wallets/{wallet_id}/balances"
-                response = requests.get(url, headers=self.headers)
+                response = await self.scheduler.call(
+                    'crossmint', self._http(requests.get), url, headers=self.headers,
+                    priority=PRIORITY_READ, timeout=self.read_queue_timeout
+                )
                 
                 if response.status_code == 200:
                     data = response.json()
@@ -217,7 +308,7 @@ class CrossmintMCPServer:
                         'usdc_balance': usdc_balance,
                         'currency': 'USDC',
                         'network': 'ethereum-sepolia',
-                        'timestamp': datetime.now().isoformat()
+                        'timestamp': request_clock().isoformat()
                     }
                 else:
                     # Return mock data for demo
@@ -226,7 +317,7 @@ class CrossmintMCPServer:
                         'usdc_balance': 10000.0,
                         'currency': 'USDC',
                         'network': 'ethereum-sepolia',
-                        'timestamp': datetime.now().isoformat(),
+                        'timestamp': request_clock().isoformat(),
                         'note': 'Using mock data - API returned ' + str(response.status_code)
                     }
             
@@ -238,11 +329,11 @@ class CrossmintMCPServer:
                 for i in range(min(limit, 5)):
                     activities.append({
                         'type': 'subsidy_received' if i % 2 == 0 else 'water_rights_purchase',
-                        'amount': round(random.uniform(10, 100), 2),
+                        'amount': round(request_rng().uniform(10, 100), 2),
                         'currency': 'USDC',
-                        'timestamp': datetime.now().isoformat(),
+                        'timestamp': request_clock().isoformat(),
                         'from': self.uncle_sam_wallet_id if i % 2 == 0 else 'market',
-                        'tx_hash': f'0x{os.urandom(32).hex()}'
+                        'tx_hash': f'0x{request_rng().getrandbits(256):064x}'
                     })
                 
                 return {
@@ -255,6 +346,10 @@ class CrossmintMCPServer:
             elif tool_name == 'execute_subsidy_transfer':
                 amount = arguments.get('amount')
                 recipient = arguments.get('recipient', self.farmer_ted_wallet)
+                # Crossmint executes a given idempotency key at most once, so resending
+                # after a timeout (here or by the client) can't pay twice
+                idempotency_key = arguments.get('idempotency_key') or request_uuid()
+                arguments = {**arguments, 'idempotency_key': idempotency_key}
                 
                 if not amount or amount <= 0:
                     raise ValueError("Invalid transfer amount")
@@ -267,7 +362,25 @@ class CrossmintMCPServer:
                     "amount": str(amount)
                 }
                 
-                response = requests.post(url, json=payload, headers=self.headers)
+                headers = {**self.headers, 'x-idempotency-key': idempotency_key}
+                
+                # Queued ahead of reads and retried on 429 until accepted, so a
+                # throttled transfer is never reported as a mock success
+                for attempt in range(self.transfer_timeout_retries + 1):
+                    try:
+                        response = await self.scheduler.call(
+                            'crossmint', self._http(requests.post), url, json=payload, headers=headers,
+                            priority=PRIORITY_WRITE, max_retries=None,
+                            on_start=write_started, on_rejected=write_rejected
+                        )
+                        break
+                    except requests.Timeout as e:
+                        if attempt == self.transfer_timeout_retries:
+                            raise TimeoutError(
+                                f"Transfer outcome unknown after {attempt + 1} timed-out attempts ({e}); "
+                                f"retry with idempotency_key={idempotency_key}"
+                            )
+                        logger.warning(f"Transfer {idempotency_key} timed out, resending: {e}")
                 
                 if response.status_code == 200:
                     result_data = response.json()
@@ -278,9 +391,9 @@ class CrossmintMCPServer:
                         'from': 'Uncle Sam',
                         'to': 'Farmer Ted' if recipient == self.farmer_ted_wallet else recipient,
                         'recipient_address': recipient,
-                        'transaction_id': result_data.get('id', f'tx_{datetime.now().timestamp()}'),
+                        'transaction_id': result_data.get('id', f'tx_{request_clock().timestamp()}'),
                         'status': 'completed',
-                        'timestamp': datetime.now().isoformat(),
+                        'timestamp': request_clock().isoformat(),
                         'network': 'ethereum-sepolia'
                     }
                 else:
@@ -292,9 +405,9 @@ class CrossmintMCPServer:
                         'from': 'Uncle Sam',
                         'to': 'Farmer Ted' if recipient == self.farmer_ted_wallet else recipient,
                         'recipient_address': recipient,
-                        'transaction_id': f'mock_tx_{datetime.now().timestamp()}',
+                        'transaction_id': f'mock_tx_{request_clock().timestamp()}',
                         'status': 'completed',
-                        'timestamp': datetime.now().isoformat(),
+                        'timestamp': request_clock().isoformat(),
                         'network': 'ethereum-sepolia',
                         'note': 'Mock transaction - API returned ' + str(response.status_code)
                     }
@@ -303,13 +416,13 @@ class CrossmintMCPServer:
                 region = arguments.get('region', 'California')
                 
                 # Simulate drought index (0-100, higher = more severe drought)
-                drought_index = random.uniform(60, 95)
+                drought_index = request_rng().uniform(60, 95)
                 
                 return {
                     'region': region,
                     'drought_index': round(drought_index, 2),
                     'severity': 'Extreme' if drought_index > 80 else 'Severe' if drought_index > 70 else 'Moderate',
-                    'timestamp': datetime.now().isoformat(),
+                    'timestamp': request_clock().isoformat(),
                     'subsidy_eligible': drought_index > 70,
                     'recommended_subsidy': round(drought_index * 10, 2) if drought_index > 70 else 0
                 }
@@ -344,6 +457,22 @@ class CrossmintMCPServer:
                 
                 return result
             
+            elif tool_name == 'sweep_subsidy_eligibility':
+                series = self.drought_series
+                if self.trace:
+                    # Record the series scored so replay scores the same data
+                    series = DroughtSeries.from_dict(self.trace.wrap('drought_series', series.to_dict)())
+                return sweep_eligibility(
+                    series,
+                    arguments.get('farmers', []),
+                    threshold=float(arguments.get('threshold', DEFAULT_THRESHOLD)),
+                    subsidy_per_point=float(arguments.get('subsidy_per_point', DEFAULT_SUBSIDY_PER_POINT)),
+                    lags=arguments.get('lags') or DEFAULT_LAGS
+                )
+            
+            elif tool_name == 'get_rate_limit_stats':
+                return self.scheduler.stats()
+            
             else:
                 raise ValueError(f"Unknown tool: {tool_name}")
                 
@@ -355,31 +484,28 @@ class CrossmintMCPServer:
                 'arguments': arguments
             }
 
+    def _traced(self, endpoint: str, fn):
+        """Route an upstream call through the session recorder or replay player, if any"""
+        return self.trace.wrap(endpoint, fn) if self.trace else fn
+
+    def _http(self, fn):
+        """Traced requests call with the HTTP socket timeout applied"""
+        return functools.partial(self._traced('crossmint', fn), timeout=self.http_timeout)
+
     async def run(self):
         """Main server loop"""
         logger.info("Starting Crossmint MCP Server...")
-        
-        while True:
-            try:
-                line = await asyncio.get_event_loop().run_in_executor(None, sys.stdin.readline)
-                if not line:
-                    break
-                
-                line = line.strip()
-                if not line:
-                    continue
-                
-                request = json.loads(line)
-                response = await self.handle_request(request)
-                
-                print(json.dumps(response), flush=True)
-                
-            except json.JSONDecodeError as e:
-                logger.error(f"Invalid JSON: {e}")
-            except Exception as e:
-                logger.error(f"Server error: {e}")
-                break
+        await self.serve()
 
 if __name__ == '__main__':
-    server = CrossmintMCPServer()
-    asyncio.run(server.run())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Crossmint MCP Server')
+    parser.add_argument('--replay', metavar='TRACE', help='Replay a recorded session trace offline and print a summary')
+    args = parser.parse_args()
+    
+    if args.replay:
+        server = CrossmintMCPServer(replay=True)
+        summary = asyncio.run(TracePlayer(args.replay).replay(server))
+        print(json.dumps(summary, indent=2))
+    else:
+        server = CrossmintMCPServer()
+        asyncio.run(server.run())
\ No newline at end of file
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Vectorized drought subsidy sweep for the Crossmint MCP server.
+
+Scores every farmer in one numpy pass over the weekly drought index of the
+water basin they farm in and returns a batch of transfers ready to be
+disbursed.
+
+A basin's score is the worse of its current weekly reading and the mean over
+each trailing lag window (by default the last 8 and 12 weeks, the lags the
+NQH2O notebook found most predictive). A basin is therefore eligible both
+when drought is severe right now and when it has been sustained.
+"""
+
+import csv
+import math
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# The five NQH2O water basins used in research/notebooks/NQH2O_Prediction_GridMET.ipynb
+BASINS = (
+    'Central_Basin',
+    'Chino_Basin',
+    'Main_San_Gabriel_Basin',
+    'Mojave_Basin',
+    'California_Surface_Water'
+)
+DEFAULT_LAGS = (8, 12)
+DEFAULT_THRESHOLD = 70.0
+DEFAULT_SUBSIDY_PER_POINT = 10.0
+
+
+class DroughtSeries:
+    """Weekly drought index (0-100, higher = more severe) per basin, oldest week first"""
+
+    def __init__(self, dates: Sequence[str], basins: Sequence[str], values: np.ndarray, source: str):
+        if values.shape != (len(dates), len(basins)):
+            raise ValueError(f"Drought series shape {values.shape} does not match {len(dates)} weeks x {len(basins)} basins")
+        self.dates = list(dates)
+        self.basins = list(basins)
+        self.basin_index = {basin: i for i, basin in enumerate(self.basins)}
+        self.values = values
+        self.source = source
+
+    @classmethod
+    def from_csv(cls, path: str) -> 'DroughtSeries':
+        """Load a CSV with a `date` column followed by one column per basin.
+
+        Dates must be ISO (YYYY-MM-DD); rows may come in any order and are
+        sorted by date. Raises ValueError naming the offending line for a
+        missing header, ragged rows, missing, malformed or repeated dates, or
+        blank, non-numeric, NaN or out-of-range (0-100) values.
+        """
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if not header or len(header) < 2 or not all(name.strip() for name in header[1:]):
+                raise ValueError(f"{path}: expected a header of date followed by basin names")
+
+            rows = []
+            seen_dates = {}
+            for row in reader:
+                if not any(cell.strip() for cell in row):
+                    continue
+                line = reader.line_num
+                if len(row) != len(header):
+                    raise ValueError(f"{path}:{line}: expected {len(header)} columns, got {len(row)}")
+                if not row[0].strip():
+                    raise ValueError(f"{path}:{line}: missing date")
+                try:
+                    week = date.fromisoformat(row[0].strip())
+                except ValueError:
+                    raise ValueError(f"{path}:{line}: date {row[0]!r} is not an ISO date (YYYY-MM-DD)")
+                if week in seen_dates:
+                    raise ValueError(f"{path}:{line}: date {week} already given on line {seen_dates[week]}")
+                seen_dates[week] = line
+                values = []
+                for basin, cell in zip(header[1:], row[1:]):
+                    try:
+                        value = float(cell)
+                    except ValueError:
+                        raise ValueError(f"{path}:{line}: {basin} value {cell!r} is not a number")
+                    if math.isnan(value) or not 0 <= value <= 100:
+                        raise ValueError(f"{path}:{line}: {basin} value {cell!r} must be a number between 0 and 100")
+                    values.append(value)
+                rows.append((week, values))
+
+        if not rows:
+            raise ValueError(f"{path}: no drought readings")
+        rows.sort(key=lambda row: row[0])
+        return cls(
+            [week.isoformat() for week, _ in rows],
+            [name.strip() for name in header[1:]],
+            np.array([values for _, values in rows], dtype=np.float64),
+            source=path
+        )
+
+    @classmethod
+    def simulated(cls, weeks: int = 104, basins: Sequence[str] = BASINS,
+                  seed: Optional[int] = None) -> 'DroughtSeries':
+        """Random-walk series in the same range check_drought_index simulates"""
+        rng = np.random.default_rng(seed)
+        start = rng.uniform(60, 95, size=len(basins))
+        steps = rng.normal(0, 2.5, size=(weeks, len(basins)))
+        values = np.clip(start + np.cumsum(steps, axis=0), 0, 100)
+        end = np.datetime64('today', 'W')
+        dates = [str(d) for d in np.arange(end - np.timedelta64(weeks - 1, 'W'), end + 1)]
+        return cls(dates, basins, values, source='simulated')
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain JSON form, e.g. for a session trace; see from_dict"""
+        return {
+            'dates': self.dates,
+            'basins': self.basins,
+            'values': self.values.ravel().tolist(),
+            'source': self.source
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DroughtSeries':
+        values = np.asarray(data['values'], dtype=np.float64).reshape(len(data['dates']), len(data['basins']))
+        return cls(data['dates'], data['basins'], values, source=data['source'])
+
+    def basin_scores(self, lags: Sequence[int]) -> np.ndarray:
+        """Per basin, the max of the latest week and the mean of each trailing `lag`-week window"""
+        lags = np.asarray(lags, dtype=np.int64)
+        if lags.size == 0 or lags.min() < 1 or lags.max() > len(self.dates):
+            raise ValueError(f"Lag windows must be between 1 and {len(self.dates)} weeks")
+        # Row k of the reversed running sum covers the latest k + 1 weeks
+        recent_sums = np.cumsum(self.values[::-1], axis=0)
+        window_means = recent_sums[lags - 1] / lags[:, None]
+        return np.maximum(self.values[-1], window_means.max(axis=0))
+
+
+def _check_lags(lags: Sequence[Any]) -> Tuple[int, ...]:
+    """Lag windows as ints; each must be a positive whole number of weeks"""
+    if not isinstance(lags, (list, tuple)):
+        raise ValueError(f"Lag windows must be a list of weeks, got {lags!r}")
+    checked = []
+    for lag in lags:
+        if isinstance(lag, bool) or not isinstance(lag, (int, float)) or not float(lag).is_integer() or lag < 1:
+            raise ValueError(f"Lag windows must be positive whole numbers of weeks, got {lag!r}")
+        checked.append(int(lag))
+    if not checked:
+        raise ValueError("At least one lag window is required")
+    return tuple(checked)
+
+
+def sweep_eligibility(series: DroughtSeries, farmers: Iterable[Dict[str, Any]],
+                      threshold: float = DEFAULT_THRESHOLD,
+                      subsidy_per_point: float = DEFAULT_SUBSIDY_PER_POINT,
+                      lags: Sequence[int] = DEFAULT_LAGS) -> Dict[str, Any]:
+    """Score all farmers at once and return the disbursement batch.
+
+    Each farmer_id and each recipient is paid at most once; repeats are
+    listed under `duplicates` instead of producing a second transfer.
+    Raises ValueError for a non-finite threshold, a subsidy_per_point that is
+    not a positive number, or lags that are not positive whole numbers.
+    """
+    if not math.isfinite(threshold):
+        raise ValueError(f"Threshold must be a finite number, got {threshold!r}")
+    if not math.isfinite(subsidy_per_point) or subsidy_per_point <= 0:
+        raise ValueError(f"subsidy_per_point must be a positive number, got {subsidy_per_point!r}")
+    lags = _check_lags(lags)
+
+    # Keep the first entry per farmer_id
+    unique: List[Dict[str, Any]] = []
+    duplicates: List[Dict[str, Any]] = []
+    seen_farmers = set()
+    for farmer in farmers:
+        farmer_id = farmer.get('farmer_id')
+        if farmer_id in seen_farmers:
+            duplicates.append({'farmer_id': farmer_id, 'reason': 'duplicate farmer_id'})
+            continue
+        seen_farmers.add(farmer_id)
+        unique.append(farmer)
+    farmers = unique
+
+    basin_scores = series.basin_scores(lags)
+
+    # Map each farmer to its basin column; -1 marks an unknown basin
+    idx = np.fromiter(
+        (series.basin_index.get(f.get('basin'), -1) for f in farmers),
+        dtype=np.int64, count=len(farmers)
+    )
+    known = idx >= 0
+    scores = np.where(known, basin_scores[np.maximum(idx, 0)], np.nan)
+    eligible = known & (scores > threshold)
+    amounts = np.where(eligible, np.round(scores * subsidy_per_point, 2), 0.0)
+    # Same bands as check_drought_index (70 / 80 at the default threshold),
+    # scaled so "Extreme" stays a third of the way from threshold to 100
+    extreme_cutoff = threshold + (100 - threshold) / 3
+    severity = np.select([scores > extreme_cutoff, scores > threshold], ['Extreme', 'Severe'], default='Moderate')
+
+    transfers: List[Dict[str, Any]] = []
+    needs_recipient: List[str] = []
+    seen_recipients = set()
+    for i in np.flatnonzero(eligible).tolist():
+        farmer = farmers[i]
+        farmer_id = farmer.get('farmer_id')
+        if not farmer.get('recipient'):
+            needs_recipient.append(farmer_id)
+            continue
+        if farmer['recipient'] in seen_recipients:
+            duplicates.append({'farmer_id': farmer_id, 'reason': 'duplicate recipient'})
+            continue
+        seen_recipients.add(farmer['recipient'])
+        transfers.append({
+            'farmer_id': farmer_id,
+            'recipient': farmer['recipient'],
+            'basin': farmer['basin'],
+            'drought_index': round(float(scores[i]), 2),
+            'severity': str(severity[i]),
+            'amount': float(amounts[i])
+        })
+
+    return {
+        'as_of': series.dates[-1],
+        'source': series.source,
+        'threshold': threshold,
+        'subsidy_per_point': subsidy_per_point,
+        'lag_windows_weeks': [int(lag) for lag in lags],
+        'basin_drought_index': {
+            basin: round(float(score), 2) for basin, score in zip(series.basins, basin_scores)
+        },
+        'farmers_evaluated': len(farmers),
+        'extreme_cutoff': round(extreme_cutoff, 2),
+        'eligible_count': int(eligible.sum()),
+        'total_subsidy': round(sum(t['amount'] for t in transfers), 2),
+        'currency': 'USDC',
+        'transfers': transfers,
+        'needs_recipient': needs_recipient,
+        'duplicates': duplicates,
+        'ineligible': [farmers[i].get('farmer_id') for i in np.flatnonzero(known & ~eligible).tolist()],
+        'unknown_basin': [farmers[i].get('farmer_id') for i in np.flatnonzero(~known).tolist()]
+    }
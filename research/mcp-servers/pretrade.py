@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Pre-trade validation for the Alpaca MCP server.
+
+Keeps a local index of the broker's assets, a cached view of buying power and
+recently seen prices so orders that are bound to be rejected (unknown symbol,
+non-tradable or non-fractionable asset, insufficient buying power) fail
+locally instead of spending a broker round-trip and a slot of the trading quota.
+
+A buy is checked against buying power using its limit price, or for market
+orders the last cached price of the symbol. A market buy for a symbol with no
+fresh price only fails locally when buying power is already exhausted.
+"""
+
+import time
+from typing import Any, Dict, Iterable, NamedTuple, Optional, Tuple
+
+
+class OrderRejected(ValueError):
+    """Order failed pre-trade validation and was not sent to the broker"""
+
+
+class AssetInfo(NamedTuple):
+    tradable: bool
+    fractionable: bool
+
+
+class PreTradeValidator:
+    """Asset index refreshed daily plus short-lived buying power and price caches"""
+
+    def __init__(self, asset_ttl: float = 24 * 60 * 60, account_ttl: float = 30.0,
+                 price_ttl: float = 60.0):
+        self.asset_ttl = asset_ttl
+        self.account_ttl = account_ttl
+        self.price_ttl = price_ttl
+        self.assets: Dict[str, AssetInfo] = {}
+        self.assets_loaded_at: Optional[float] = None
+        self.buying_power: Optional[float] = None
+        self.trading_blocked = False
+        self.account_loaded_at: Optional[float] = None
+        # symbol -> (price, monotonic time seen)
+        self.prices: Dict[str, Tuple[float, float]] = {}
+
+    def assets_stale(self) -> bool:
+        return self.assets_loaded_at is None or time.monotonic() - self.assets_loaded_at > self.asset_ttl
+
+    def account_stale(self) -> bool:
+        return self.account_loaded_at is None or time.monotonic() - self.account_loaded_at > self.account_ttl
+
+    def defer_assets(self, seconds: float):
+        """After a failed asset listing, wait `seconds` before trying again"""
+        self.assets_loaded_at = time.monotonic() - self.asset_ttl + seconds
+
+    def defer_account(self, seconds: float):
+        """After a failed get_account, wait `seconds` before trying again"""
+        self.account_loaded_at = time.monotonic() - self.account_ttl + seconds
+
+    def load_assets(self, assets: Iterable[Any]):
+        """Rebuild the index from the trading client's asset listing"""
+        self.assets = {
+            str(asset.symbol).upper(): AssetInfo(
+                tradable=bool(asset.tradable),
+                fractionable=bool(asset.fractionable)
+            )
+            for asset in assets
+        }
+        self.assets_loaded_at = time.monotonic()
+
+    def load_account(self, account: Any):
+        """Refresh buying power and trading flags from get_account"""
+        self.buying_power = float(account.buying_power)
+        self.trading_blocked = bool(account.trading_blocked or account.account_blocked)
+        self.account_loaded_at = time.monotonic()
+
+    def record_price(self, symbol: str, price: Any):
+        """Remember a quote or position price for estimating market order cost"""
+        if price:
+            self.prices[symbol.upper()] = (float(price), time.monotonic())
+
+    def last_price(self, symbol: str) -> Optional[float]:
+        cached = self.prices.get(symbol.upper())
+        if cached is None or time.monotonic() - cached[1] > self.price_ttl:
+            return None
+        return cached[0]
+
+    def reserve(self, amount: float):
+        """Hold back buying power for a submitted order until the next refresh"""
+        if self.buying_power is not None:
+            self.buying_power -= amount
+
+    def validate(self, symbol: Optional[str], side: Optional[str], quantity: Any,
+                 order_type: str, limit_price: Optional[float] = None) -> str:
+        """Raise OrderRejected if the order cannot succeed; return the normalized symbol"""
+        if not symbol:
+            raise OrderRejected("Symbol is required")
+        symbol = symbol.upper()
+
+        if side not in ('buy', 'sell'):
+            raise OrderRejected(f"Invalid side: {side}")
+
+        try:
+            quantity = float(quantity)
+        except (TypeError, ValueError):
+            raise OrderRejected(f"Invalid quantity: {quantity}")
+        if quantity <= 0:
+            raise OrderRejected("Quantity must be positive")
+
+        if order_type == 'limit' and not limit_price:
+            raise OrderRejected("Limit price required for limit orders")
+
+        if self.trading_blocked:
+            raise OrderRejected("Trading is blocked on this account")
+
+        # An empty index means the listing could not be loaded; leave symbol
+        # checks to the broker rather than rejecting everything
+        if self.assets:
+            asset = self.assets.get(symbol)
+            if asset is None:
+                raise OrderRejected(f"Unknown symbol: {symbol}")
+            if not asset.tradable:
+                raise OrderRejected(f"{symbol} is not tradable")
+            if not quantity.is_integer() and not asset.fractionable:
+                raise OrderRejected(f"{symbol} does not support fractional quantities")
+
+        if side == 'buy' and self.buying_power is not None:
+            if self.buying_power <= 0:
+                raise OrderRejected("Insufficient buying power")
+            cost = self.order_cost(symbol, quantity, limit_price)
+            if cost is not None and cost > self.buying_power:
+                raise OrderRejected(
+                    f"Insufficient buying power: order needs ~{cost:.2f}, available {self.buying_power:.2f}"
+                )
+
+        return symbol
+
+    def order_cost(self, symbol: str, quantity: Any, limit_price: Optional[float]) -> Optional[float]:
+        """Notional of an order at its limit price, or estimated from the last cached price"""
+        price = limit_price or self.last_price(symbol)
+        if not price:
+            return None
+        return float(quantity) * float(price)
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Client-side rate limiting for the MCP servers' upstream APIs.
+
+Each upstream endpoint class (Alpaca trading, Alpaca market data, Crossmint)
+gets a token bucket sized to its quota. Calls wait in a priority queue for a
+token instead of bursting into the API and coming back as 429s, so order
+submission and transfers are served ahead of quote polling.
+"""
+
+import asyncio
+import functools
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Lower value = served first
+PRIORITY_WRITE = 0
+PRIORITY_READ = 10
+PRIORITY_POLL = 20
+
+MAX_BACKOFF_SECONDS = 30.0
+
+
+class RateLimitTimeout(Exception):
+    """A queued call's deadline passed before a token became available"""
+
+
+class RateLimitExceeded(Exception):
+    """The upstream kept answering 429 after all retries were used"""
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate_per_minute`"""
+
+    def __init__(self, rate_per_minute: float, burst: int):
+        self.rate_per_minute = rate_per_minute
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token can be taken (0 if one is available now)"""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """Hold the bucket closed for `seconds`, e.g. the Retry-After of an upstream 429.
+
+        One token is left for the retry so it goes out as soon as the pause
+        ends rather than a refill interval later; the normal rate applies after it.
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = 1.0
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class _Endpoint:
+    def __init__(self, name: str, bucket: TokenBucket):
+        self.name = name
+        self.bucket = bucket
+        # Heap of (priority, seq, deadline, future)
+        self.waiters: List[Tuple[int, int, Optional[float], asyncio.Future]] = []
+        self.drainer: Optional[asyncio.Task] = None
+        self.stats = {
+            'requests': 0,
+            'immediate': 0,
+            'queued': 0,
+            'expired': 0,
+            'throttled_429': 0,
+            'retried': 0,
+            'peak_queue_depth': 0,
+            'total_wait_seconds': 0.0,
+            'max_wait_seconds': 0.0,
+        }
+
+
+class RequestScheduler:
+    """Per-endpoint token buckets with a priority queue of waiting calls.
+
+    With `throttle=False` (used for offline replay) calls are never queued or
+    paused, but 429 retries and statistics behave as usual.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, int]], throttle: bool = True):
+        self.throttle = throttle
+        self._endpoints = {
+            name: _Endpoint(name, TokenBucket(rate_per_minute, burst))
+            for name, (rate_per_minute, burst) in limits.items()
+        }
+        self._seq = itertools.count()
+
+    async def acquire(self, endpoint: str, priority: int = PRIORITY_READ,
+                      timeout: Optional[float] = None):
+        """Wait for a token on `endpoint`; raise RateLimitTimeout after `timeout` seconds"""
+        ep = self._endpoints[endpoint]
+        now = time.monotonic()
+        ep.stats['requests'] += 1
+
+        if not self.throttle:
+            ep.stats['immediate'] += 1
+            return
+
+        if not ep.waiters and ep.bucket.wait_time(now) == 0:
+            ep.bucket.take(now)
+            ep.stats['immediate'] += 1
+            return
+
+        deadline = now + timeout if timeout is not None else None
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(ep.waiters, (priority, next(self._seq), deadline, future))
+        ep.stats['queued'] += 1
+        ep.stats['peak_queue_depth'] = max(ep.stats['peak_queue_depth'], len(ep.waiters))
+        if ep.drainer is None or ep.drainer.done():
+            ep.drainer = asyncio.ensure_future(self._drain(ep))
+
+        await future
+
+        waited = time.monotonic() - now
+        ep.stats['total_wait_seconds'] += waited
+        ep.stats['max_wait_seconds'] = max(ep.stats['max_wait_seconds'], waited)
+
+    async def call(self, endpoint: str, fn: Callable[..., Any], *args,
+                   priority: int = PRIORITY_READ, timeout: Optional[float] = None,
+                   max_retries: Optional[int] = 3,
+                   on_start: Optional[Callable[[], None]] = None,
+                   on_rejected: Optional[Callable[[], None]] = None, **kwargs) -> Any:
+        """Run a blocking upstream call once a token is granted, retrying on 429s.
+
+        `timeout` bounds the total time spent queueing. `max_retries=None`
+        retries 429s until the call goes through, which is what writes use.
+        `on_start` is called just before each attempt leaves the queue for the
+        wire, and `on_rejected` after an attempt the upstream turned away with
+        a 429, i.e. without executing it.
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        loop = asyncio.get_running_loop()
+        attempt = 0
+
+        while True:
+            remaining = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            await self.acquire(endpoint, priority, remaining)
+            if on_start is not None:
+                on_start()
+
+            try:
+                result = await loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+            except Exception as e:
+                if _status_code(e) != 429:
+                    raise
+                throttled = e
+            else:
+                if _status_code(result) != 429:
+                    return result
+                throttled = result
+
+            if on_rejected is not None:
+                on_rejected()
+            self._throttled(endpoint, throttled, attempt)
+            if max_retries is not None and attempt >= max_retries:
+                raise RateLimitExceeded(f"{endpoint}: upstream returned 429 after {attempt + 1} attempts")
+            attempt += 1
+            self._endpoints[endpoint].stats['retried'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of bucket state and throttling counters per endpoint"""
+        now = time.monotonic()
+        snapshot = {}
+        for name, ep in self._endpoints.items():
+            ep.bucket.wait_time(now)  # refill before reporting
+            snapshot[name] = {
+                'rate_per_minute': ep.bucket.rate_per_minute,
+                'burst': int(ep.bucket.capacity),
+                'tokens_available': round(ep.bucket.tokens, 2),
+                'paused_for_seconds': round(max(0.0, ep.bucket.paused_until - now), 2),
+                'queue_depth': sum(1 for w in ep.waiters if not w[3].done()),
+                **{k: round(v, 3) if isinstance(v, float) else v for k, v in ep.stats.items()},
+            }
+        return snapshot
+
+    def _throttled(self, endpoint: str, source: Any, attempt: int):
+        ep = self._endpoints[endpoint]
+        ep.stats['throttled_429'] += 1
+        if not self.throttle:
+            return
+        delay = _retry_after(source)
+        if delay is None:
+            delay = min(MAX_BACKOFF_SECONDS, 2.0 ** attempt)
+        logger.warning(f"{endpoint} throttled by upstream (429), pausing {delay:.1f}s")
+        ep.bucket.pause(delay)
+
+    async def _drain(self, ep: _Endpoint):
+        """Hand out tokens to waiters in priority order as the bucket refills"""
+        while ep.waiters:
+            now = time.monotonic()
+            self._expire(ep, now)
+            if not ep.waiters:
+                break
+
+            delay = ep.bucket.wait_time(now)
+            if delay > 0:
+                # Wake up early if a queued deadline falls due in the meantime
+                deadlines = [w[2] for w in ep.waiters if w[2] is not None]
+                if deadlines:
+                    delay = min(delay, max(0.0, min(deadlines) - now))
+                await asyncio.sleep(delay)
+                continue
+
+            _, _, _, future = heapq.heappop(ep.waiters)
+            if future.done():
+                # Caller was cancelled while queued
+                continue
+            ep.bucket.take(now)
+            future.set_result(None)
+
+    def _expire(self, ep: _Endpoint, now: float):
+        kept = []
+        for waiter in ep.waiters:
+            _, _, deadline, future = waiter
+            if future.done():
+                continue
+            if deadline is not None and deadline <= now:
+                ep.stats['expired'] += 1
+                future.set_exception(RateLimitTimeout(f"{ep.name}: deadline passed while queued for rate limit"))
+                continue
+            kept.append(waiter)
+        if len(kept) != len(ep.waiters):
+            heapq.heapify(kept)
+            ep.waiters = kept
+
+
+def _status_code(obj: Any) -> Optional[int]:
+    """HTTP status of a requests.Response, HTTPError or alpaca APIError"""
+    code = getattr(obj, 'status_code', None)
+    if code is None:
+        code = getattr(getattr(obj, 'response', None), 'status_code', None)
+    try:
+        return int(code) if code is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(obj: Any) -> Optional[float]:
+    headers = getattr(obj, 'headers', None)
+    if headers is None:
+        headers = getattr(getattr(obj, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        return min(MAX_BACKOFF_SECONDS, float(headers.get('Retry-After')))
+    except (TypeError, ValueError):
+        return None
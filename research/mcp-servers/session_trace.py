@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Session tracing and offline replay for the MCP servers.
+
+The recorder appends one compact JSON line per JSON-RPC request, response and
+upstream API call (with timings) to a rotating log. File I/O happens on a
+background thread so the request path only pays for serialization. Every
+record carries the id of the server session that wrote it, so one file can
+hold many sessions.
+
+Upstream results are stored as plain JSON: SDK models as their field values,
+HTTP responses as status, headers and body. Request objects and credential
+headers are never written.
+
+The player reads such a log back and feeds every recorded request through the
+server's `handle_request`, answering upstream calls from the recorded results
+instead of the network, then compares the new responses with the recorded ones.
+
+So that replayed responses can match, tools take timestamps from
+`request_clock()` and randomness (including generated ids) from `request_rng()`:
+while tracing these are the request's recorded arrival time and a generator
+seeded from its recorded seed. Transport errors such as requests.Timeout are
+raised again as their own type on replay.
+"""
+
+import contextvars
+import importlib
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (session, sequence number) of the request being handled, inherited by its upstream calls
+_current_request: contextvars.ContextVar = contextvars.ContextVar('mcp_trace_request', default=None)
+
+
+class _RequestEnv(NamedTuple):
+    rng: random.Random
+    clock: float
+
+
+# Seeded generator and frozen clock of the traced request being handled
+_request_env: contextvars.ContextVar = contextvars.ContextVar('mcp_trace_env', default=None)
+_live_rng = random.Random()
+
+# Header names, or fragments of them, that are never written to a trace
+_SECRET_HEADER_HINTS = ('authorization', 'cookie', 'key', 'secret', 'token')
+
+
+class ReplayMismatch(Exception):
+    """The replayed session made an upstream call the recording does not contain"""
+
+
+class RecordedUpstreamError(Exception):
+    """Stand-in for an upstream exception during replay"""
+
+    def __init__(self, message: str, error_type: str, status_code: Optional[int] = None,
+                 headers: Optional[Dict[str, str]] = None):
+        super().__init__(message)
+        self.error_type = error_type
+        self.status_code = status_code
+        self.headers = headers or {}
+        # Like requests.HTTPError, so `error.response.status_code` works too
+        self.response = RecordedResponse(status_code, self.headers, '') if status_code is not None else None
+
+
+class RecordedResponse:
+    """Stand-in for a requests.Response during replay"""
+
+    def __init__(self, status_code: int, headers: Dict[str, str], body: str, url: Optional[str] = None):
+        self.status_code = status_code
+        self.headers = headers
+        self.text = body
+        self.content = body.encode('utf-8')
+        self.url = url
+        self.ok = status_code < 400
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+def request_clock() -> datetime:
+    """Current time for tool output; the request's recorded arrival time while tracing"""
+    env = _request_env.get()
+    return datetime.fromtimestamp(env.clock) if env else datetime.now()
+
+
+def request_rng() -> random.Random:
+    """Random source for tool output; seeded from the trace while tracing"""
+    env = _request_env.get()
+    return env.rng if env else _live_rng
+
+
+def request_uuid() -> str:
+    """Random UUID4 string drawn from request_rng()"""
+    return str(uuid.UUID(int=request_rng().getrandbits(128), version=4))
+
+
+def _call_name(fn: Callable) -> str:
+    return getattr(fn, '__qualname__', None) or getattr(fn, '__name__', repr(fn))
+
+
+def _safe_headers(headers: Any) -> Dict[str, str]:
+    return {
+        str(name): str(value) for name, value in dict(headers or {}).items()
+        if not any(hint in str(name).lower() for hint in _SECRET_HEADER_HINTS)
+    }
+
+
+def _encode(obj: Any) -> Any:
+    """JSON form of an upstream result; see _decode for the inverse"""
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, (list, tuple)):
+        return {'t': 'list', 'v': [_encode(item) for item in obj]}
+    if isinstance(obj, dict):
+        return {'t': 'dict', 'v': {str(k): _encode(v) for k, v in obj.items()}}
+    if hasattr(obj, 'model_dump'):
+        cls = type(obj)
+        return {'t': 'model', 'cls': f'{cls.__module__}:{cls.__qualname__}', 'v': obj.model_dump(mode='json')}
+    if hasattr(obj, 'status_code') and hasattr(obj, 'text') and hasattr(obj, 'headers'):
+        # requests.Response: keep only what the servers read, never .request
+        return {
+            't': 'http',
+            'status_code': obj.status_code,
+            'headers': _safe_headers(obj.headers),
+            'body': obj.text,
+            'url': str(getattr(obj, 'url', '') or '') or None
+        }
+    return {'t': 'repr', 'v': repr(obj)}
+
+
+def _encode_error(error: Exception) -> Dict[str, Any]:
+    status_code = getattr(error, 'status_code', None)
+    response = getattr(error, 'response', None)
+    if status_code is None:
+        status_code = getattr(response, 'status_code', None)
+    try:
+        status_code = int(status_code) if status_code is not None else None
+    except (TypeError, ValueError):
+        status_code = None
+    cls = type(error)
+    return {
+        'type': cls.__name__,
+        'cls': f'{cls.__module__}:{cls.__qualname__}',
+        'message': str(error),
+        'status_code': status_code,
+        'headers': _safe_headers(getattr(response, 'headers', None))
+    }
+
+
+def _resolve(path: str) -> Any:
+    """Import the object named by a `module:qualname` path"""
+    module, _, qualname = path.partition(':')
+    obj = importlib.import_module(module)
+    for part in qualname.split('.'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def _decode_error(error: Dict[str, Any]) -> Exception:
+    """Recorded error as its original type where that is safe, else RecordedUpstreamError.
+
+    Transport errors (no HTTP status) are rebuilt so handlers such as
+    `except requests.Timeout` run on replay. HTTP errors stay
+    RecordedUpstreamError, which keeps the status and headers callers inspect.
+    """
+    if error.get('status_code') is None and error.get('cls'):
+        try:
+            cls = _resolve(error['cls'])
+            if isinstance(cls, type) and issubclass(cls, Exception):
+                return cls(error['message'])
+        except Exception:
+            pass
+    return RecordedUpstreamError(
+        error['message'], error['type'], error.get('status_code'), error.get('headers')
+    )
+
+
+def _decode(data: Any) -> Any:
+    if not isinstance(data, dict):
+        return data
+    kind = data['t']
+    if kind == 'list':
+        return [_decode(item) for item in data['v']]
+    if kind == 'dict':
+        return {k: _decode(v) for k, v in data['v'].items()}
+    if kind == 'model':
+        try:
+            return _resolve(data['cls']).model_validate(data['v'])
+        except Exception:
+            # SDK not importable or model changed; attribute access still works
+            return json.loads(json.dumps(data['v']), object_hook=lambda d: SimpleNamespace(**d))
+    if kind == 'http':
+        return RecordedResponse(data['status_code'], data['headers'], data['body'], data.get('url'))
+    return data['v']
+
+
+class TraceRecorder:
+    """Append-only JSONL trace of a server session with size-based rotation"""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024, backups: int = 5):
+        self.path = path
+        self.session = uuid.uuid4().hex[:12]
+        self._seq = itertools.count(1)
+
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8'
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        self._listener = logging.handlers.QueueListener(records, handler)
+        self._listener.start()
+
+        self._log = logging.getLogger(f'mcp_trace.{self.session}')
+        self._log.setLevel(logging.INFO)
+        self._log.propagate = False
+        self._log.addHandler(logging.handlers.QueueHandler(records))
+
+    def _write(self, record: Dict[str, Any]):
+        record['session'] = self.session
+        record.setdefault('ts', time.time())
+        self._log.info(json.dumps(record, separators=(',', ':'), default=str))
+
+    def begin(self, request: Dict[str, Any]) -> Tuple[int, float]:
+        """Record an incoming request and tag the current task with its sequence number"""
+        n = next(self._seq)
+        seed = random.SystemRandom().getrandbits(64)
+        ts = time.time()
+        _current_request.set((self.session, n))
+        _request_env.set(_RequestEnv(random.Random(seed), ts))
+        self._write({'kind': 'request', 'n': n, 'seed': seed, 'ts': ts, 'payload': request})
+        return n, time.perf_counter()
+
+    def end(self, token: Tuple[int, float], response: Optional[Dict[str, Any]]):
+        n, started = token
+        self._write({
+            'kind': 'response',
+            'n': n,
+            'ms': round((time.perf_counter() - started) * 1000, 3),
+            'payload': response
+        })
+
+    def wrap(self, endpoint: str, fn: Callable) -> Callable:
+        """Return `fn` instrumented to record each upstream call and its outcome"""
+        current = _current_request.get()
+        n = current[1] if current else None
+        name = _call_name(fn)
+
+        def traced(*args, **kwargs):
+            started = time.perf_counter()
+            record = {'kind': 'upstream', 'n': n, 'endpoint': endpoint, 'call': name}
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                record['ms'] = round((time.perf_counter() - started) * 1000, 3)
+                record['error'] = _encode_error(e)
+                self._write(record)
+                raise
+            record['ms'] = round((time.perf_counter() - started) * 1000, 3)
+            record['result'] = _encode(result)
+            self._write(record)
+            return result
+
+        return traced
+
+    def close(self):
+        self._listener.stop()
+
+
+class TracePlayer:
+    """Answers upstream calls from a recorded trace instead of the network"""
+
+    def __init__(self, path: str):
+        # Keyed by (session, n); sessions are replayed in the order they appear
+        self.sessions: List[str] = []
+        self.requests: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self.responses: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        self._upstream: Dict[Tuple[str, int, str, str], deque] = defaultdict(deque)
+
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                session = record.get('session', '')
+                if session not in self.sessions:
+                    self.sessions.append(session)
+                key = (session, record['n'])
+                kind = record.get('kind')
+                if kind == 'request':
+                    self.requests[key] = record
+                elif kind == 'response':
+                    self.responses[key] = record
+                elif kind == 'upstream':
+                    self._upstream[key + (record['endpoint'], record['call'])].append(record)
+
+    def begin(self, session: str, n: int):
+        _current_request.set((session, n))
+        record = self.requests.get((session, n), {})
+        # Traces written before seeds were recorded replay with a live clock and RNG
+        seed = record.get('seed')
+        _request_env.set(_RequestEnv(random.Random(seed), record['ts']) if seed is not None else None)
+
+    def wrap(self, endpoint: str, fn: Callable) -> Callable:
+        session, n = _current_request.get()
+        name = _call_name(fn)
+        recorded = self._upstream[(session, n, endpoint, name)]
+
+        def replayed(*args, **kwargs):
+            if not recorded:
+                raise ReplayMismatch(f"No recorded upstream call {name} on {endpoint} for request {session}:{n}")
+            record = recorded.popleft()
+            if 'error' in record:
+                raise _decode_error(record['error'])
+            return _decode(record['result'])
+
+        return replayed
+
+    async def replay(self, server: Any) -> Dict[str, Any]:
+        """Run every recorded request through `server.handle_request` in order"""
+        server.trace = self
+        results = []
+        started = time.perf_counter()
+        order = {session: i for i, session in enumerate(self.sessions)}
+
+        for session, n in sorted(self.requests, key=lambda key: (order[key[0]], key[1])):
+            request = self.requests[(session, n)]['payload']
+            self.begin(session, n)
+            t0 = time.perf_counter()
+            response = await server.handle_request(request)
+            elapsed_ms = round((time.perf_counter() - t0) * 1000, 3)
+
+            recorded = self.responses.get((session, n))
+            results.append({
+                'session': session,
+                'n': n,
+                'method': request.get('method'),
+                'tool': (request.get('params') or {}).get('name'),
+                'recorded_ms': recorded['ms'] if recorded else None,
+                'replayed_ms': elapsed_ms,
+                # Compare what went over the wire, not the in-memory objects
+                'matches': recorded is not None and recorded['payload'] == json.loads(json.dumps(response, default=str))
+            })
+
+        return {
+            'sessions': len(self.sessions),
+            'requests': len(results),
+            'matched': sum(1 for r in results if r['matches']),
+            'mismatched': [f"{r['session']}:{r['n']}" for r in results if not r['matches']],
+            'total_replayed_ms': round((time.perf_counter() - started) * 1000, 3),
+            'calls': results
+        }
+
+
+def recorder_from_env(prefix: str) -> Optional[TraceRecorder]:
+    """Opt-in recorder configured by <PREFIX>_TRACE_FILE and friends"""
+    path = os.getenv(f'{prefix}_TRACE_FILE')
+    if not path:
+        return None
+    recorder = TraceRecorder(
+        path,
+        max_bytes=int(os.getenv(f'{prefix}_TRACE_MAX_BYTES', str(50 * 1024 * 1024))),
+        backups=int(os.getenv(f'{prefix}_TRACE_BACKUPS', '5'))
+    )
+    logger.info(f"Recording session trace to {path} (session {recorder.session})")
+    return recorder
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The servers import their helper modules by bare name, as when run as scripts
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
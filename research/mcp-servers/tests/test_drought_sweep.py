@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+
+from drought_sweep import DroughtSeries, sweep_eligibility
+
+
+def series(values, basins=('Chino_Basin',)):
+    values = np.asarray(values, dtype=np.float64).reshape(len(values), len(basins))
+    dates = [str(d) for d in np.arange(np.datetime64('2024-01-01'), np.datetime64('2024-01-01') + len(values) * 7, 7)]
+    return DroughtSeries(dates, basins, values, source='test')
+
+
+def write_csv(tmp_path, text):
+    path = tmp_path / 'drought.csv'
+    path.write_text(text)
+    return str(path)
+
+
+def test_csv_rows_are_sorted_by_date(tmp_path):
+    path = write_csv(tmp_path, 'date,Chino_Basin,Mojave_Basin\n2024-10-01,90,50\n2024-09-01,10,40\n')
+    loaded = DroughtSeries.from_csv(path)
+    assert loaded.dates == ['2024-09-01', '2024-10-01']
+    assert loaded.values[-1].tolist() == [90, 50]
+
+
+@pytest.mark.parametrize('text, message', [
+    ('', 'expected a header'),
+    ('date,Chino_Basin\n', 'no drought readings'),
+    ('date,Chino_Basin\n2024-09-01,10,20\n', ':2: expected 2 columns'),
+    ('date,Chino_Basin\n,10\n', ':2: missing date'),
+    ('date,Chino_Basin\n9/1/2024,10\n', ':2: .* is not an ISO date'),
+    ('date,Chino_Basin\n2024-09-01,10\n2024-09-01,20\n', ':3: date 2024-09-01 already given on line 2'),
+    ('date,Chino_Basin\n2024-09-01,\n', ':2: Chino_Basin value .* is not a number'),
+    ('date,Chino_Basin\n2024-09-01,nan\n', ':2: .* between 0 and 100'),
+    ('date,Chino_Basin\n2024-09-01,101\n', ':2: .* between 0 and 100'),
+])
+def test_csv_errors_name_the_line(tmp_path, text, message):
+    with pytest.raises(ValueError, match=message):
+        DroughtSeries.from_csv(write_csv(tmp_path, text))
+
+
+def test_score_is_worst_of_current_week_and_window_means():
+    # Sustained drought, easing this week: the 12-week mean is the worst reading
+    assert series([80] * 11 + [50]).basin_scores([8, 12])[0] == pytest.approx((80 * 11 + 50) / 12)
+    # Sudden drought: calm history, 99 this week
+    assert series([20] * 11 + [99]).basin_scores([8, 12])[0] == 99
+
+
+def test_lags_longer_than_series_are_rejected():
+    with pytest.raises(ValueError, match='between 1 and 3 weeks'):
+        series([50, 60, 70]).basin_scores([4])
+
+
+def test_sweep_builds_batch():
+    farmers = [
+        {'farmer_id': 'a', 'basin': 'Chino_Basin', 'recipient': '0xa'},
+        {'farmer_id': 'b', 'basin': 'Mojave_Basin', 'recipient': '0xb'},
+        {'farmer_id': 'c', 'basin': 'Atlantis', 'recipient': '0xc'},
+        {'farmer_id': 'd', 'basin': 'Chino_Basin'},
+        {'farmer_id': 'a', 'basin': 'Chino_Basin', 'recipient': '0xa2'},
+        {'farmer_id': 'e', 'basin': 'Chino_Basin', 'recipient': '0xa'},
+    ]
+    data = series([[90, 40]] * 12, basins=('Chino_Basin', 'Mojave_Basin'))
+
+    batch = sweep_eligibility(data, farmers, threshold=70, subsidy_per_point=10, lags=[8, 12])
+
+    assert [t['farmer_id'] for t in batch['transfers']] == ['a']
+    assert batch['transfers'][0]['amount'] == 900.0
+    assert batch['transfers'][0]['severity'] == 'Extreme'
+    assert batch['total_subsidy'] == 900.0
+    assert batch['ineligible'] == ['b']
+    assert batch['unknown_basin'] == ['c']
+    assert batch['needs_recipient'] == ['d']
+    assert batch['duplicates'] == [
+        {'farmer_id': 'a', 'reason': 'duplicate farmer_id'},
+        {'farmer_id': 'e', 'reason': 'duplicate recipient'},
+    ]
+
+
+def test_severity_bands_follow_threshold():
+    farmers = [{'farmer_id': 'a', 'basin': 'Chino_Basin', 'recipient': '0xa'}]
+    assert sweep_eligibility(series([75] * 12), farmers)['transfers'][0]['severity'] == 'Severe'
+    assert sweep_eligibility(series([45] * 12), farmers, threshold=40)['transfers'][0]['severity'] == 'Severe'
+
+
+@pytest.mark.parametrize('kwargs, message', [
+    ({'subsidy_per_point': -5}, 'subsidy_per_point must be a positive number'),
+    ({'subsidy_per_point': float('inf')}, 'subsidy_per_point must be a positive number'),
+    ({'threshold': float('nan')}, 'Threshold must be a finite number'),
+    ({'lags': [8.7]}, 'positive whole numbers'),
+    ({'lags': [0]}, 'positive whole numbers'),
+    ({'lags': 8}, 'must be a list'),
+    ({'lags': []}, 'At least one lag window'),
+])
+def test_sweep_rejects_bad_arguments(kwargs, message):
+    with pytest.raises(ValueError, match=message):
+        sweep_eligibility(series([75] * 12), [], **kwargs)
+
+
+def test_series_round_trips_through_dict():
+    data = series([[90, 40], [80, 30]], basins=('Chino_Basin', 'Mojave_Basin'))
+    restored = DroughtSeries.from_dict(data.to_dict())
+    assert restored.dates == data.dates
+    assert restored.basins == data.basins
+    assert np.array_equal(restored.values, data.values)
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import pytest
+
+from pretrade import OrderRejected, PreTradeValidator
+
+
+def validator(buying_power=1000.0):
+    v = PreTradeValidator()
+    v.load_assets([
+        SimpleNamespace(symbol='AAPL', tradable=True, fractionable=True),
+        SimpleNamespace(symbol='BRK.A', tradable=True, fractionable=False),
+        SimpleNamespace(symbol='HALT', tradable=False, fractionable=True),
+    ])
+    v.load_account(SimpleNamespace(buying_power=buying_power, trading_blocked=False, account_blocked=False))
+    return v
+
+
+def test_valid_order_returns_normalized_symbol():
+    assert validator().validate('aapl', 'buy', 1, 'limit', 100) == 'AAPL'
+
+
+@pytest.mark.parametrize('symbol, side, quantity, order_type, limit_price, message', [
+    (None, 'buy', 1, 'market', None, 'Symbol is required'),
+    ('AAPL', 'hold', 1, 'market', None, 'Invalid side'),
+    ('AAPL', 'buy', 0, 'market', None, 'Quantity must be positive'),
+    ('AAPL', 'buy', 1, 'limit', None, 'Limit price required'),
+    ('NOPE', 'buy', 1, 'market', None, 'Unknown symbol'),
+    ('HALT', 'sell', 1, 'market', None, 'not tradable'),
+    ('BRK.A', 'sell', 0.5, 'market', None, 'fractional'),
+    ('AAPL', 'buy', 20, 'limit', 100, 'Insufficient buying power'),
+])
+def test_rejects_orders_bound_to_fail(symbol, side, quantity, order_type, limit_price, message):
+    with pytest.raises(OrderRejected, match=message):
+        validator().validate(symbol, side, quantity, order_type, limit_price)
+
+
+def test_market_buy_is_costed_from_cached_price():
+    v = validator()
+    # No price cached yet: left to the broker
+    assert v.validate('AAPL', 'buy', 20, 'market') == 'AAPL'
+    v.record_price('aapl', 100)
+    with pytest.raises(OrderRejected, match='needs ~2000.00'):
+        v.validate('AAPL', 'buy', 20, 'market')
+
+
+def test_stale_price_is_ignored():
+    v = PreTradeValidator(price_ttl=-1)
+    v.record_price('AAPL', 100)
+    assert v.last_price('AAPL') is None
+
+
+def test_reserve_holds_back_buying_power():
+    v = validator(buying_power=1000.0)
+    v.reserve(v.order_cost('AAPL', 8, 100))
+    with pytest.raises(OrderRejected):
+        v.validate('AAPL', 'buy', 3, 'limit', 100)
+
+
+def test_exhausted_buying_power_rejects_uncosted_buy():
+    with pytest.raises(OrderRejected, match='Insufficient buying power'):
+        validator(buying_power=0).validate('AAPL', 'buy', 1, 'market')
+
+
+def test_empty_index_leaves_symbol_checks_to_broker():
+    v = PreTradeValidator()
+    assert v.validate('ANY', 'sell', 1, 'market') == 'ANY'
+
+
+def test_failed_asset_load_does_not_defer_account_refresh():
+    v = PreTradeValidator(account_ttl=30)
+    v.defer_assets(300)
+    assert not v.assets_stale()
+    assert v.account_stale()
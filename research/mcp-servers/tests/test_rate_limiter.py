@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import pytest
+
+from rate_limiter import (
+    PRIORITY_POLL,
+    PRIORITY_READ,
+    PRIORITY_WRITE,
+    RateLimitExceeded,
+    RateLimitTimeout,
+    RequestScheduler,
+    TokenBucket,
+)
+
+
+class Throttled:
+    """Minimal requests.Response answering 429"""
+
+    status_code = 429
+
+    def __init__(self, retry_after='0.05'):
+        self.headers = {'Retry-After': retry_after}
+
+
+def test_bucket_allows_burst_then_paces():
+    bucket = TokenBucket(rate_per_minute=60, burst=2)
+    now = time.monotonic()
+    bucket.take(now)
+    bucket.take(now)
+    assert bucket.wait_time(now) == pytest.approx(1.0, abs=0.01)
+
+
+def test_pause_holds_only_for_retry_after():
+    bucket = TokenBucket(rate_per_minute=60, burst=1)
+    bucket.take(time.monotonic())
+    bucket.pause(0.1)
+    assert 0 < bucket.wait_time(time.monotonic()) <= 0.1
+    assert bucket.wait_time(time.monotonic() + 0.11) == 0.0
+
+
+def test_waiters_are_served_in_priority_order():
+    async def scenario():
+        scheduler = RequestScheduler({'api': (600, 1)})
+        await scheduler.acquire('api')  # use up the burst so the rest queue
+        served = []
+
+        async def wait(name, priority):
+            await scheduler.acquire('api', priority)
+            served.append(name)
+
+        await asyncio.gather(
+            wait('poll', PRIORITY_POLL),
+            wait('read', PRIORITY_READ),
+            wait('write', PRIORITY_WRITE),
+        )
+        return served, scheduler.stats()['api']
+
+    served, stats = asyncio.run(scenario())
+    assert served == ['write', 'read', 'poll']
+    assert stats['queued'] == 3
+    assert stats['peak_queue_depth'] == 3
+
+
+def test_queued_call_expires_at_its_deadline():
+    async def scenario():
+        scheduler = RequestScheduler({'api': (6, 1)})  # next token in 10 s
+        await scheduler.acquire('api')
+        started = time.monotonic()
+        with pytest.raises(RateLimitTimeout):
+            await scheduler.acquire('api', timeout=0.05)
+        return time.monotonic() - started, scheduler.stats()['api']
+
+    waited, stats = asyncio.run(scenario())
+    assert waited < 1
+    assert stats['expired'] == 1
+    assert stats['queue_depth'] == 0
+
+
+def test_call_retries_429_after_retry_after():
+    responses = [Throttled(), Throttled(), 'ok']
+
+    async def scenario():
+        scheduler = RequestScheduler({'api': (600, 5)})
+        result = await scheduler.call('api', responses.pop, priority=PRIORITY_WRITE)
+        return result, scheduler.stats()['api']
+
+    responses.reverse()
+    result, stats = asyncio.run(scenario())
+    assert result == 'ok'
+    assert stats['throttled_429'] == 2
+    assert stats['retried'] == 2
+
+
+def test_call_gives_up_after_max_retries():
+    async def scenario():
+        scheduler = RequestScheduler({'api': (600, 5)})
+        await scheduler.call('api', Throttled, max_retries=1)
+
+    with pytest.raises(RateLimitExceeded):
+        asyncio.run(scenario())
+
+
+def test_unthrottled_scheduler_never_waits():
+    async def scenario():
+        scheduler = RequestScheduler({'api': (6, 1)}, throttle=False)
+        started = time.monotonic()
+        for _ in range(5):
+            await scheduler.acquire('api')
+        return time.monotonic() - started, scheduler.stats()['api']
+
+    elapsed, stats = asyncio.run(scenario())
+    assert elapsed < 0.1
+    assert stats['immediate'] == 5
@@ -0,0 +1,114 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from session_trace import (
+    RecordedResponse,
+    RecordedUpstreamError,
+    TracePlayer,
+    TraceRecorder,
+    request_clock,
+    request_uuid,
+)
+
+calls = []
+
+
+def fetch(kind):
+    """Stand-in upstream call; replay must never reach it"""
+    calls.append(kind)
+    if kind == 'slow':
+        raise TimeoutError('read timed out')
+    if kind == 'throttled':
+        error = Exception('rate limited')
+        error.response = SimpleNamespace(status_code=429, headers={'Retry-After': '1'})
+        raise error
+    return SimpleNamespace(
+        status_code=200,
+        headers={'Content-Type': 'application/json', 'x-api-key': 'sk_live_secret'},
+        text=json.dumps({'kind': kind}),
+        url='https://api.example/ok'
+    )
+
+
+class Server:
+    """Smallest server the recorder and player drive: one upstream call per request"""
+
+    def __init__(self):
+        self.trace = None
+
+    async def handle_request(self, request):
+        kind = request['params']['kind']
+        try:
+            response = self.trace.wrap('api', fetch)(kind)
+            body = json.loads(response.text)
+        except TimeoutError:
+            body = 'timed out'
+        except Exception as e:
+            body = {'error': str(e), 'status': e.response.status_code}
+        return {
+            'jsonrpc': '2.0',
+            'id': request['id'],
+            'result': {'body': body, 'at': request_clock().isoformat(), 'nonce': request_uuid()}
+        }
+
+
+def record(path, kinds):
+    server = Server()
+    server.trace = TraceRecorder(str(path))
+
+    async def dispatch(request):
+        token = server.trace.begin(request)
+        server.trace.end(token, await server.handle_request(request))
+
+    async def session():
+        for i, kind in enumerate(kinds):
+            await asyncio.ensure_future(dispatch({'id': i, 'method': 'tools/call', 'params': {'kind': kind}}))
+
+    asyncio.run(session())
+    server.trace.close()
+    return server.trace.session
+
+
+def test_round_trip_matches_without_network(tmp_path):
+    path = tmp_path / 'trace.jsonl'
+    record(path, ['ok', 'slow', 'throttled'])
+    record(path, ['ok'])
+    calls.clear()
+
+    summary = asyncio.run(TracePlayer(str(path)).replay(Server()))
+
+    assert calls == []
+    assert summary['sessions'] == 2
+    assert summary['requests'] == 4
+    assert summary['matched'] == 4, summary['mismatched']
+
+
+def test_credential_headers_are_not_written(tmp_path):
+    path = tmp_path / 'trace.jsonl'
+    record(path, ['ok'])
+    text = path.read_text()
+    assert 'sk_live_secret' not in text
+    assert 'Content-Type' in text
+
+
+def test_replayed_upstream_results_keep_their_shape(tmp_path):
+    path = tmp_path / 'trace.jsonl'
+    session = record(path, ['ok', 'slow', 'throttled'])
+    player = TracePlayer(str(path))
+
+    results = {}
+    for n in (1, 2, 3):
+        player.begin(session, n)
+        try:
+            results[n] = player.wrap('api', fetch)()
+        except Exception as e:
+            results[n] = e
+
+    assert isinstance(results[1], RecordedResponse)
+    assert results[1].json() == {'kind': 'ok'}
+    # Transport errors come back as their own type, HTTP errors with status and headers
+    assert type(results[2]) is TimeoutError
+    assert isinstance(results[3], RecordedUpstreamError)
+    assert results[3].status_code == 429
+    assert results[3].headers == {'Retry-After': '1'}
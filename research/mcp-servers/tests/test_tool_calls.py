@@ -0,0 +1,149 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from rate_limiter import PRIORITY_WRITE, RequestScheduler
+from tool_calls import (
+    REQUEST_TIMEOUT,
+    ToolCall,
+    ToolCallServer,
+    ToolCallTimeout,
+    run_with_deadline,
+    write_rejected,
+    write_started,
+)
+
+
+class Throttled:
+    status_code = 429
+    headers = {'Retry-After': '0.05'}
+
+
+class Upstream:
+    """Blocking upstream write that takes `latency` seconds and answers `replies` in turn"""
+
+    def __init__(self, latency=0.0, replies=('done',)):
+        self.latency = latency
+        self.replies = list(replies)
+        self.sent = 0
+
+    def __call__(self):
+        self.sent += 1
+        time.sleep(self.latency)
+        return self.replies[min(self.sent, len(self.replies)) - 1]
+
+
+def write(scheduler, upstream):
+    return scheduler.call(
+        'api', upstream, priority=PRIORITY_WRITE, max_retries=None,
+        on_start=write_started, on_rejected=write_rejected
+    )
+
+
+def exhausted_scheduler():
+    """Scheduler whose only token is spent, so the next write queues for ~10 s"""
+    scheduler = RequestScheduler({'api': (6, 1)})
+    scheduler._endpoints['api'].bucket.take(time.monotonic())
+    return scheduler
+
+
+def test_queued_write_times_out_without_being_sent():
+    upstream = Upstream()
+
+    async def scenario():
+        with pytest.raises(ToolCallTimeout):
+            await run_with_deadline(ToolCall(), write(exhausted_scheduler(), upstream), 0.05)
+
+    asyncio.run(scenario())
+    assert upstream.sent == 0
+
+
+def test_queued_write_can_be_cancelled():
+    upstream = Upstream()
+
+    async def scenario():
+        call = ToolCall()
+        asyncio.get_running_loop().call_later(0.05, lambda: cancelled.append(call.cancel()))
+        with pytest.raises(asyncio.CancelledError):
+            await run_with_deadline(call, write(exhausted_scheduler(), upstream), 5)
+
+    cancelled = []
+    asyncio.run(scenario())
+    assert cancelled == [True]
+    assert upstream.sent == 0
+
+
+def test_sent_write_returns_its_result_past_the_deadline():
+    upstream = Upstream(latency=0.2)
+
+    async def scenario():
+        call = ToolCall()
+        asyncio.get_running_loop().call_later(0.05, lambda: cancelled.append(call.cancel()))
+        return await run_with_deadline(call, write(RequestScheduler({'api': (600, 5)}), upstream), 0.1)
+
+    cancelled = []
+    assert asyncio.run(scenario()) == 'done'
+    assert cancelled == [False]
+    assert upstream.sent == 1
+
+
+def test_deadline_applies_between_429_retries():
+    upstream = Upstream(replies=[Throttled()])
+
+    async def scenario():
+        started = time.monotonic()
+        with pytest.raises(ToolCallTimeout):
+            await run_with_deadline(ToolCall(), write(RequestScheduler({'api': (600, 5)}), upstream), 0.2)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) < 1
+    assert upstream.sent >= 1
+
+
+def test_cancel_during_attempt_applies_once_it_is_rejected():
+    upstream = Upstream(latency=0.1, replies=[Throttled()])
+
+    async def scenario():
+        call = ToolCall()
+        asyncio.get_running_loop().call_later(0.05, lambda: cancelled.append(call.cancel()))
+        with pytest.raises(asyncio.CancelledError):
+            await run_with_deadline(call, write(RequestScheduler({'api': (600, 5)}), upstream), 5)
+
+    cancelled = []
+    asyncio.run(scenario())
+    # Refused while the attempt was out, honoured as soon as it came back 429
+    assert cancelled == [False]
+    assert upstream.sent == 1
+
+
+class Server(ToolCallServer):
+    def __init__(self, delay):
+        self.delay = delay
+        self.trace = None
+        self._init_tool_calls('TEST', {'slow_tool': 0.05})
+
+    async def execute_tool(self, tool_name, arguments):
+        await asyncio.sleep(self.delay)
+        return {'tool': tool_name, **arguments}
+
+
+def test_call_tool_wraps_result_as_text_content():
+    response = asyncio.run(Server(0).call_tool(7, {'name': 'echo', 'arguments': {'x': 1}}))
+    assert response['id'] == 7
+    assert json.loads(response['result']['content'][0]['text']) == {'tool': 'echo', 'x': 1}
+
+
+def test_call_tool_reports_timeout_with_mcp_code():
+    server = Server(1)
+    response = asyncio.run(server.call_tool(8, {'name': 'slow_tool', 'arguments': {}}))
+    assert response['error']['code'] == REQUEST_TIMEOUT
+    assert server.tool_calls == {}
+
+
+def test_tool_timeout_defaults_and_caps():
+    server = Server(0)
+    assert server._tool_timeout('slow_tool', {}) == 0.05
+    assert server._tool_timeout('other', {}) == server.default_tool_timeout
+    assert server._tool_timeout('other', {'timeout': 10 ** 6}) == server.max_tool_timeout
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Deadlines and cancellation for MCP tool calls.
+
+A deadline or `notifications/cancelled` aborts a tool call only while none of
+its upstream writes is on the wire; a write still waiting for a rate limit token
+is simply dropped. Once a write has gone out it cannot be recalled, so the call
+is allowed to finish and its real result is returned, instead of the client
+seeing a failure for an order or transfer that actually went through.
+
+A write the upstream answered with 429 was not executed, so it no longer
+counts as sent: an abort that arrived meanwhile takes effect before the retry.
+
+ToolCallServer is the stdio request loop both MCP servers share: requests are
+handled concurrently on a bounded pool, each tools/call runs under its
+deadline, and new requests are refused once too many are pending.
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# JSON-RPC server error codes. REQUEST_TIMEOUT is MCP's own "request timed out";
+# MCP also takes -32000, -32002 (resource not found) and -32042, so overload
+# uses a code from the server range that MCP leaves free.
+REQUEST_TIMEOUT = -32001
+SERVER_OVERLOADED = -32010
+
+_current_call: contextvars.ContextVar = contextvars.ContextVar('mcp_tool_call', default=None)
+
+
+class ToolCallTimeout(Exception):
+    """The deadline passed before the tool call sent any upstream write"""
+
+
+class ToolCall:
+    """Tracks one running tools/call so it can be cancelled safely"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        # Writes sent upstream that may have been executed
+        self.writes_started = 0
+        # Set when a deadline or cancel could not be honoured because of a write in flight
+        self.abort_pending = False
+
+    def cancel(self) -> bool:
+        """Abort the call unless a write is in flight; return whether it was aborted.
+
+        If a write is in flight the abort is remembered and happens as soon as
+        that write turns out to have been rejected with a 429.
+        """
+        if self.task is None or self.task.done():
+            return False
+        if self.writes_started:
+            self.abort_pending = True
+            return False
+        self.task.cancel()
+        return True
+
+
+def write_started():
+    """Mark the current tool call as having an upstream write on the wire"""
+    call = _current_call.get()
+    if call is not None:
+        if call.abort_pending and not call.writes_started:
+            # Aborted while an earlier attempt was out; don't send another
+            raise asyncio.CancelledError()
+        call.writes_started += 1
+
+
+def write_rejected():
+    """Unmark a write the upstream refused (429) without executing it"""
+    call = _current_call.get()
+    if call is not None and call.writes_started:
+        call.writes_started -= 1
+        if call.abort_pending and not call.writes_started:
+            call.task.cancel()
+
+
+async def run_with_deadline(call: ToolCall, coro: Awaitable[Any], timeout: float) -> Any:
+    """Await `coro` as `call`, honouring `timeout` whenever no write is in flight.
+
+    Raises ToolCallTimeout on an expired deadline and CancelledError if the
+    call was cancelled through `ToolCall.cancel`.
+    """
+    token = _current_call.set(call)
+    try:
+        # The task copies the context, so write_started() inside it finds `call`
+        call.task = asyncio.ensure_future(coro)
+    finally:
+        _current_call.reset(token)
+
+    timed_out = False
+    try:
+        done, _ = await asyncio.wait({call.task}, timeout=timeout)
+        if not done:
+            timed_out = True
+            if call.cancel():
+                raise ToolCallTimeout(f"timed out after {timeout}s")
+            logger.warning(f"Deadline of {timeout}s passed with an upstream write in flight; waiting for its result")
+            await asyncio.wait({call.task})
+    except asyncio.CancelledError:
+        call.cancel()
+        raise
+
+    if timed_out and call.task.cancelled():
+        # The write in flight was rejected with a 429, so the deadline applied after all
+        raise ToolCallTimeout(f"timed out after {timeout}s")
+    return call.task.result()
+
+
+class ToolCallServer:
+    """Concurrent stdio loop with per-tool deadlines, cancellation and load shedding.
+
+    Servers call `_init_tool_calls` from `__init__` and provide
+    `handle_request`, `execute_tool` and a `trace` attribute (None when not
+    tracing); `handle_request` delegates tools/call to `call_tool`.
+    """
+
+    def _init_tool_calls(self, prefix: str, tool_timeouts: Dict[str, float]):
+        """Read <PREFIX>_TOOL_TIMEOUT, _MAX_TOOL_TIMEOUT, _MAX_CONCURRENT and _MAX_PENDING"""
+        # Per-tool deadlines (seconds); callers may override with params.timeout
+        self.default_tool_timeout = float(os.getenv(f'{prefix}_TOOL_TIMEOUT', '20'))
+        self.max_tool_timeout = float(os.getenv(f'{prefix}_MAX_TOOL_TIMEOUT', '300'))
+        self.tool_timeouts = tool_timeouts
+
+        # Worker pool size, and how many requests may wait for it before new ones are refused
+        self.pool = asyncio.Semaphore(int(os.getenv(f'{prefix}_MAX_CONCURRENT', '8')))
+        self.max_pending = int(os.getenv(f'{prefix}_MAX_PENDING', '64'))
+        self.in_flight: Dict[Any, asyncio.Task] = {}
+        self.tool_calls: Dict[Any, ToolCall] = {}
+
+    async def call_tool(self, request_id: Any, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Run a tools/call under its deadline and build the JSON-RPC response"""
+        tool_name = params.get('name')
+        arguments = params.get('arguments', {})
+
+        timeout = self._tool_timeout(tool_name, params)
+        call = ToolCall()
+        if request_id is not None:
+            self.tool_calls[request_id] = call
+        try:
+            result = await run_with_deadline(call, self.execute_tool(tool_name, arguments), timeout)
+        except ToolCallTimeout:
+            logger.warning(f"Tool {tool_name} timed out after {timeout}s")
+            return {
+                'jsonrpc': '2.0',
+                'id': request_id,
+                'error': {
+                    'code': REQUEST_TIMEOUT,
+                    'message': f'Tool {tool_name} timed out after {timeout}s'
+                }
+            }
+        finally:
+            if self.tool_calls.get(request_id) is call:
+                del self.tool_calls[request_id]
+
+        return {
+            'jsonrpc': '2.0',
+            'id': request_id,
+            'result': {
+                'content': [
+                    {
+                        'type': 'text',
+                        'text': json.dumps(result, indent=2)
+                    }
+                ]
+            }
+        }
+
+    def _tool_timeout(self, tool_name: str, params: Dict[str, Any]) -> float:
+        """Deadline for a tool call: params.timeout if given, else the server default"""
+        timeout = params.get('timeout')
+        if not isinstance(timeout, (int, float)) or timeout <= 0:
+            timeout = self.tool_timeouts.get(tool_name, self.default_tool_timeout)
+        return min(float(timeout), self.max_tool_timeout)
+
+    def _cancel(self, params: Dict[str, Any]):
+        """Handle notifications/cancelled by aborting the matching in-flight request"""
+        request_id = params.get('requestId')
+        call = self.tool_calls.get(request_id)
+        if call is not None:
+            if call.cancel():
+                logger.info(f"Cancelled request {request_id}: {params.get('reason', 'no reason given')}")
+            else:
+                logger.info(f"Request {request_id} has an upstream write in flight; finishing it instead of cancelling")
+            return
+
+        # Not yet running a tool (e.g. still waiting for a pool slot)
+        task = self.in_flight.get(request_id)
+        if task and not task.done():
+            logger.info(f"Cancelling request {request_id}: {params.get('reason', 'no reason given')}")
+            task.cancel()
+
+    async def _dispatch(self, request: Dict[str, Any]):
+        token = self.trace.begin(request) if self.trace else None
+        try:
+            async with self.pool:
+                response = await self.handle_request(request)
+        except asyncio.CancelledError:
+            # The client asked for this; MCP says no response is sent
+            if self.trace:
+                self.trace.end(token, None)
+            return
+        if self.trace:
+            self.trace.end(token, response)
+        print(json.dumps(response), flush=True)
+
+    async def serve(self):
+        """Read JSON-RPC requests from stdin until EOF and answer them on stdout"""
+        # Requests are handled concurrently so the scheduler can order
+        # upstream calls by priority; responses are matched by id
+        pending = set()
+        # Own thread for stdin so hung upstream calls can't starve the reader
+        stdin_executor = ThreadPoolExecutor(max_workers=1)
+
+        while True:
+            try:
+                line = await asyncio.get_event_loop().run_in_executor(stdin_executor, sys.stdin.readline)
+                if not line:
+                    break
+
+                line = line.strip()
+                if not line:
+                    continue
+
+                request = json.loads(line)
+                request_id = request.get('id')
+
+                if request.get('method') == 'notifications/cancelled':
+                    self._cancel(request.get('params') or {})
+                    continue
+
+                # Shed load early instead of letting the queue and latency grow
+                if len(pending) >= self.max_pending:
+                    logger.warning(f"Refusing request {request_id}: {len(pending)} requests pending")
+                    if request_id is not None:
+                        print(json.dumps({
+                            'jsonrpc': '2.0',
+                            'id': request_id,
+                            'error': {
+                                'code': SERVER_OVERLOADED,
+                                'message': f'Server overloaded: {len(pending)} requests pending'
+                            }
+                        }), flush=True)
+                    continue
+
+                task = asyncio.ensure_future(self._dispatch(request))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                if request_id is not None:
+                    self.in_flight[request_id] = task
+                    task.add_done_callback(
+                        lambda t, rid=request_id: self.in_flight.pop(rid, None) if self.in_flight.get(rid) is t else None
+                    )
+
+            except json.JSONDecodeError as e:
+                logger.error(f"Invalid JSON: {e}")
+            except Exception as e:
+                logger.error(f"Server error: {e}")
+                break
+
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self.trace:
+            self.trace.close()
+        stdin_executor.shutdown(wait=False)